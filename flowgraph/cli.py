@@ -16,18 +16,29 @@
 """
 from __future__ import absolute_import
 
+import ast
 import six
 import sys
 
 import click
 
+from .core.annotator import Annotator
 from .core.record import record_code
+from .core.remote_annotation_db import RemoteAnnotationDB
+from .trace.ast_util import get_imported_packages
 
 
 @click.command()
 @click.argument('script', type=click.File('r'))
 @click.option('-o', '--out', type=click.File('wb'))
 def cli(script, out):
-    code = script.read()
+    node = ast.parse(script.read())
     out = out or (sys.stdout.buffer if six.PY3 else sys.stdout)
-    graph = record_code(code, out=out, store_slots=False)
+
+    # Fetch annotations for all imported packages up front.
+    db = RemoteAnnotationDB.from_library_config()
+    annotator = Annotator(db=db)
+    annotator.prefetch(get_imported_packages(node))
+
+    graph = record_code(node, out=out, db=db, annotator=annotator,
+                        store_slots=False)
@@ -20,7 +20,7 @@ from pathlib2 import Path
 import blitzdb
 from blitzdb import fields
 import sqlalchemy
-from traitlets import HasTraits, Instance, default
+from traitlets import HasTraits, Instance, Set, default
 
 
 class AnnotationDB(HasTraits):
@@ -33,15 +33,23 @@ class AnnotationDB(HasTraits):
     # Underlying in-memory database backend.
     _database = Instance(blitzdb.backends.base.Backend)
     
+    # Packages having at least one annotation in the database.
+    _packages = Set()
+    
     def load_documents(self, notes):
         """ Load annotations from an iterable of JSON documents
         (JSON-able dictionaries).
         """
-        for note in notes:
-            if note['schema'] == 'annotation' and note['language'] == 'python':
-                doc = Annotation(note)
-                doc.pk = note['_id']
-                self._database.save(doc)
+        # Save all the documents in a single transaction, rather than one
+        # transaction per document.
+        with self._database.transaction():
+            for note in notes:
+                if (note['schema'] == 'annotation' and
+                    note['language'] == 'python'):
+                    doc = Annotation(note)
+                    doc.pk = note['_id']
+                    self._database.save(doc)
+                    self._packages.add(note['package'])
     
     def load_file(self, filename):
         """ Load annotations from a JSON file.
@@ -52,6 +60,13 @@ class AnnotationDB(HasTraits):
         with Path(filename).open('r') as f:
             self.load_documents(json.load(f))
 
+    def has_package(self, package):
+        """ Does the database have any annotations for the given package?
+        
+        This method does not query the database.
+        """
+        return package in self._packages
+
     def get(self, query):
         """ Get a single document matching the query.
         
@@ -75,6 +90,19 @@ class AnnotationDB(HasTraits):
         return (doc.attributes for doc in blitz_result
                 if self._query_json(query, doc.attributes))
     
+    def filter_many(self, query, packages):
+        """ Get all documents matching the query in any of the given packages.
+        
+        Issues a single query for all the packages. Returns an iterable.
+        """
+        packages = list(packages)
+        query = dict(query)
+        if len(packages) == 1:
+            query['package'] = packages[0]
+        else:
+            query['package'] = { '$in': packages }
+        return self.filter(query)
+    
     # Private interface
     
     def _query_json(self, query, obj):
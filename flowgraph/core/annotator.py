@@ -15,12 +15,12 @@
 from __future__ import absolute_import
 
 import inspect
-from operator import attrgetter
+import itertools
 import six
+import types
+from weakref import WeakKeyDictionary
 
-from cachetools import cachedmethod
-from cachetools.keys import hashkey
-from traitlets import HasTraits, Dict, Instance
+from traitlets import HasTraits, Dict, Instance, Set, observe
 
 from .annotation_db import AnnotationDB
 from .remote_annotation_db import RemoteAnnotationDB
@@ -35,6 +35,9 @@ class Annotator(HasTraits):
     database:
         - Type resolution based on Python's MRO (method resolution order)
         - Aggressive caching to improve performance when tracing
+    
+    Because of the caching, the annotations returned are shared between
+    lookups. Treat them as read-only, copying them before any modification.
     """
     
     # Database of annotations.
@@ -44,19 +47,47 @@ class Annotator(HasTraits):
     
     # Private traits.
     _func_cache = Dict()
+    _func_note_cache = Instance(WeakKeyDictionary, ())
     _type_cache = Dict()
+    _type_note_cache = Instance(WeakKeyDictionary, ())
+    _note_classes_cache = Dict()
+    _class_info_cache = Instance(WeakKeyDictionary, ())
+    _type_key_cache = Instance(WeakKeyDictionary, ())
+    _loaded_packages = Set()
+    _prefetched = Set()
+    _prefetch_index = Dict()
     
     def notate_function(self, func):
         """ Find annotation for a Python function.
 
         By a "function", we actually mean any callable object
         (function, instance method, class method, type, etc.).
+        
+        Returns a JSON dict or None if there are no annotations. The dict is
+        shared through the annotator's caches, so it must not be modified.
         """
         if not callable(func):
             raise TypeError("Attempt to annotate non-callable as function")
         
-        pk = self._cached_notate_function(func)
-        return self.db.get({'pk': pk}) if pk else None          
+        # Fast path: look up plain functions and classes directly. (Bound
+        # methods are created anew on each attribute access.)
+        direct = isinstance(func, _direct_func_types)
+        if direct:
+            try:
+                return self._func_note_cache[func]
+            except KeyError:
+                pass
+        
+        cls = self._get_method_self(func)
+        key = self._get_func_key(func, cls)
+        cache = self._func_cache
+        try:
+            note = cache[key]
+        except KeyError:
+            note = cache[key] = self._find_function_annotation(func, cls)
+        if direct:
+            self._func_note_cache[func] = note
+        return note
     
     def notate_object(self, obj):
         """ Find annotation for a Python object.
@@ -68,22 +99,63 @@ class Annotator(HasTraits):
     def notate_type(self, type):
         """ Find annotation for a Python type.
         
-        Returns a JSON dict or None if there are no annotations.
+        Returns a JSON dict or None if there are no annotations. The dict is
+        shared through the annotator's caches, so it must not be modified.
+        """
+        # Fast path: look up the type object directly.
+        try:
+            return self._type_note_cache[type]
+        except KeyError:
+            pass
+        
+        key = self._get_type_key(type)
+        cache = self._type_cache
+        try:
+            note = cache[key]
+        except KeyError:
+            note = cache[key] = self._find_type_annotation(type)
+        self._type_note_cache[type] = note
+        return note
+    
+    def prefetch(self, packages):
+        """ Prefetch annotations for the given Python packages.
+        
+        The annotations are fetched from the database in a single query and
+        indexed locally, so that later lookups in these packages do not hit
+        the database. This is useful when the packages are known in advance,
+        e.g., from the imports of a script. The builtins package is always
+        prefetched.
+        
+        Packages without annotations in the database are not prefetched, so
+        that annotations loaded for them later are still found.
         """
-        pk = self._cached_notate_type(type)
-        return self.db.get({'pk': pk}) if pk else None
+        # Every class derives from `object`, so type and method lookups always
+        # query the builtins package.
+        packages = set(packages)
+        packages.add('builtins')
+        packages = [ p for p in packages if p not in self._prefetched ]
+        if not packages:
+            return
+        notes = self._query_db({ 'language': 'python' }, packages)
+        packages = [ p for p in packages if self.db.has_package(p) ]
+        index = { (package, kind): [] for package in packages
+                  for kind in ('type', 'function') }
+        for note in notes:
+            index[(note['package'], note['kind'])].append(note)
+        self._prefetch_index.update(index)
+        self._prefetched.update(packages)
     
     # Private interface
     
-    @cachedmethod(cache=attrgetter('_func_cache'),
-                  key=lambda self, func: self._get_func_key(func))
-    def _cached_notate_function(self, func):
-        """ Notate a function object, returning the primary key or None.
-        """        
+    def _find_function_annotation(self, func, cls=None):
+        """ Find annotation for a function object, bypassing the cache.
+        
+        If the function is a method, `cls` is the type of the object to which
+        it is bound (see `_get_method_self`).
+        """
         # If the function is a method, try to find a method annotation.
         note = None
-        if inspect.ismethod(func):
-            cls = self._get_method_self(func)
+        if cls is not None:
             query_extra = { 
                 'kind': 'function',
                 'method': func.__name__,
@@ -100,27 +172,54 @@ class Annotator(HasTraits):
                 'kind': 'function',
                 'function': name,
             }
-            note = next(self._query(query), None)
+            note = next(self._query(query, [package]), None)
         
-        return note['pk'] if note else None
+        return note
     
-    @cachedmethod(cache=attrgetter('_type_cache'),
-                  key=lambda self, type: self._get_type_key(type))
-    def _cached_notate_type(self, type):
-        """ Notate a type, returning the primary key or None.
+    def _find_type_annotation(self, type):
+        """ Find annotation for a type, bypassing the cache.
         """
         extra_query = { 'kind': 'type' }
-        note = self._resolve_type(type, extra_query)
-        return note['pk'] if note else None
+        return self._resolve_type(type, extra_query)
     
-    def _query(self, query):
-        """ Query the annotation DB.
+    def _query(self, query, packages):
+        """ Query the annotation DB for annotations in any of the given
+        packages.
+        
+        Prefetched packages are looked up in the local index, so that only the
+        remaining packages are queried in the database.
+        """
+        prefetched = self._prefetched
+        local = [ p for p in packages if p in prefetched ]
+        packages = [ p for p in packages if p not in prefetched ]
+        notes = self._query_db(query, packages) if packages else iter([])
+        if local:
+            index, kind = self._prefetch_index, query['kind']
+            local_notes = (note for package in local
+                           for note in index[(package, kind)]
+                           if all(note.get(key) == value
+                                  for key, value in query.items()))
+            notes = itertools.chain(local_notes, notes)
+        return notes
+    
+    def _query_db(self, query, packages):
+        """ Query the annotation DB, bypassing the prefetched packages.
         """
         # Ensure package annotations have been loaded.
         if isinstance(self.db, RemoteAnnotationDB):
-            self.db.load_package(query['package'])
+            loaded = self._loaded_packages
+            for package in packages:
+                if package not in loaded:
+                    self.db.load_package(package)
+                    loaded.add(package)
+        
+        # Skip packages without any annotations.
+        db = self.db
+        packages = [ p for p in packages if db.has_package(p) ]
+        if not packages:
+            return iter([])
         
-        return self.db.filter(query)
+        return db.filter_many(query, packages)
     
     def _resolve_type(self, type, query_extra={}):
         """ Find the best annotation for a Python type from a list of
@@ -129,77 +228,134 @@ class Annotator(HasTraits):
         If there is no maximal element, an arbitrary element is returned.
         """
         # Get all subclasses using the MRO (we ignore the order here).
-        mro = inspect.getmro(type)
-        subclasses = { get_class_full_name(c) : c for c in mro }
+        mro = type.__mro__
+        infos = [ self._get_class_info(c) for c in mro ]
+        subclasses = { name: c for c, (name, _) in zip(mro, infos) }
+        
+        # Precompute the subclass relation on the MRO as bitmasks: the mask
+        # for a class has a bit set for each of its subclasses in the MRO.
+        index = { name: i for i, name in enumerate(subclasses) }
+        submasks = {
+            name: sum(1 << index[other] for other, c2 in subclasses.items()
+                      if issubclass(c2, c1))
+            for name, c1 in subclasses.items()
+        }
+        
+        # Query all packages spanned by the MRO at once, rather than once
+        # per class, since classes frequently share a package.
+        packages = []
+        for _, package in infos:
+            if package not in packages:
+                packages.append(package)
+        query = { 'language': 'python' }
+        query.update(query_extra)
         
         # Find the best (highest precedence) annotation.
-        best = None
-        for name, subclass in subclasses.items():
-            package = get_class_module_name(subclass).split('.')[0]
-            query = {
-                'language': 'python',
-                'package': package,
-            }
-            query.update(query_extra)
-            for note in self._query(query):
-                note_classes = self._get_annotation_classes(note)
-                if (set(note_classes).issubset(subclasses) and
-                    (best is None or 
-                     self._annotation_le(subclasses, best, note))):
-                    best = note
+        # An annotation including the type itself is maximal, so we can stop
+        # as soon as we find one.
+        type_bit = 1 << index[infos[0][0]]
+        best, best_classes, best_mask = None, None, 0
+        for note in self._query(query, packages):
+            note_classes = self._get_annotation_classes(note)
+            if not all(name in index for name in note_classes):
+                continue
+            note_mask = sum(1 << index[name] for name in note_classes)
+            if best is not None and note_mask == best_mask:
+                continue
+            if (best is None or
+                self._annotation_le(submasks, best_classes, note_mask)):
+                best, best_classes, best_mask = note, note_classes, note_mask
+                if best_mask & type_bit:
+                    break
         return best
     
-    def _annotation_le(self, subclasses, first, second):
+    def _annotation_le(self, submasks, first, second):
         """ Is the first object annotation "less than or equal to"
         (lower precedence than) the second?
         
         We declare that `first <= second` iff every class in `first` is
         a superclass of some class in `second`. This defines a *partial order*
         on the annotations.
-        """
-        def issuperclass(c1, c2):
-            return issubclass(subclasses[c2], subclasses[c1])
         
-        first = self._get_annotation_classes(first)
-        second = self._get_annotation_classes(second)
-        return all(any(issuperclass(c1,c2) for c2 in second) for c1 in first)
+        The first annotation is given by its classes and the second by the
+        bitmask of its classes; see `_resolve_type` for `submasks`.
+        """
+        return all(submasks[name] & second for name in first)
     
     def _get_annotation_classes(self, note):
-        """ Get the list of classes for an object or method annotation.
+        """ Get the set of classes for an object or method annotation.
         """
-        try:
-            names = note['class']
-        except KeyError:
-            return []
-        if isinstance(names, six.string_types):
-            names = [ names ]
-        return names
+        pk = note['pk']
+        classes = self._note_classes_cache.get(pk)
+        if classes is None:
+            names = note.get('class', [])
+            if isinstance(names, six.string_types):
+                names = [ names ]
+            classes = self._note_classes_cache[pk] = frozenset(names)
+        return classes
     
-    def _get_func_key(self, func):
+    def _get_func_key(self, func, cls=None):
         """ Key for function cache.
         """
         # For methods, we include the type of the object to which the method
         # is bound. This will differ from the type in the method's qualified
         # name when there is subclassing without method overriding.
-        if inspect.ismethod(func):
-            type_key = self._get_type_key(self._get_method_self(func))
-        else:
-            type_key = None
+        type_key = self._get_type_key(cls) if cls is not None else None
         return (get_func_full_name(func), type_key)
     
     def _get_type_key(self, type):
         """ Key for type cache.
+        
+        The key is the tuple of full names of classes in the MRO, so that
+        distinct classes with identical structure, such as classes created
+        dynamically, share a cache entry.
+        """
+        key = self._type_key_cache.get(type)
+        if key is None:
+            key = tuple(self._get_class_info(c)[0] for c in type.__mro__)
+            self._type_key_cache[type] = key
+        return key
+    
+    def _get_class_info(self, cls):
+        """ Get the full name and package name of a class.
         """
-        return get_class_full_name(type)
+        info = self._class_info_cache.get(cls)
+        if info is None:
+            package = get_class_module_name(cls).split('.')[0]
+            info = (get_class_full_name(cls), package)
+            self._class_info_cache[cls] = info
+        return info
     
     def _get_method_self(self, func):
-        """ Get the object to which the method is bound.
+        """ Get the type of the object to which the method is bound.
+        
+        Returns None if the function is not a method.
         """
-        assert inspect.ismethod(func)
-        if type(func.__self__) is type(object):
-            # Class method: __self__ has type `type`
+        if not inspect.ismethod(func):
+            return None
+        if isinstance(func.__self__, type):
+            # Class method: __self__ is a type
             cls = func.__self__
         else:
             # Instance method
             cls = func.__self__.__class__
         return cls
+    
+    # Trait observers
+    
+    @observe('db')
+    def _db_changed(self, change):
+        """ Forget annotations and packages from the previous database.
+        """
+        self._func_cache = {}
+        self._func_note_cache = WeakKeyDictionary()
+        self._type_cache = {}
+        self._type_note_cache = WeakKeyDictionary()
+        self._note_classes_cache = {}
+        self._loaded_packages = set()
+        self._prefetched = set()
+        self._prefetch_index = {}
+
+
+# Callable types whose annotations can be cached by the object itself.
+_direct_func_types = (types.FunctionType, type)
@@ -14,15 +14,15 @@
 
 from __future__ import absolute_import
 
-from collections import deque, OrderedDict
+from collections import defaultdict, OrderedDict
+from itertools import count
 import six
 import sys
 import types
 from weakref import WeakKeyDictionary
 
 from ipykernel.jsonutil import json_clean
-import networkx as nx
-from traitlets import HasTraits, Bool, Dict, Instance, Unicode, default
+from traitlets import HasTraits, Bool, Instance, Int
 
 from .annotator import Annotator
 from .flow_graph import new_flow_graph
@@ -52,31 +52,61 @@ class FlowGraphBuilder(HasTraits):
     # Whether to store annotated slots for objects on creation or mutation.
     store_slots = Bool(True)
     
-    # Private traits.
-    _node_names = Dict()
-    _stack = Instance(deque, ()) # List(Instance(_CallContext))
+    # Minimum number of outputs at which garbage-collected objects are pruned
+    # from the output table of a flow graph.
+    min_output_table_limit = Int(1024)
     
     # Public interface
     
     def __init__(self, **traits):
         super(FlowGraphBuilder, self).__init__(**traits)
+        
+        # Private state is stored in plain attributes, not traits, because it
+        # is accessed on every trace event.
+        self._annotation_keys = {}
+        self._node_names = defaultdict(lambda: count(1))
+        self._nonprimitive_types = WeakKeyDictionary()
+        self._stack = [] # List(_CallContext)
+        self._ufunc_type = None
+        self._event_handlers = {
+            TraceCall: self._push_call_event,
+            TraceReturn: self._push_return_event,
+            TraceAccess: self._push_access_event,
+            TraceAssign: self._push_assign_event,
+            TraceDelete: self._push_delete_event,
+        }
         self.reset()
     
     @property
     def graph(self):
         """ Top-level flow graph.
+        
+        The graph is not copied. It continues to be modified as events are
+        pushed, until the builder is reset, so callers that need a snapshot
+        during tracing should copy it.
         """
-        # Make a shallow copy.
-        return nx.MultiDiGraph(self._stack[0].graph)
+        return self._stack[0].graph
+    
+    def get_output_ids(self):
+        """ Get the IDs of the objects that are outputs of the top-level flow
+        graph.
+        
+        Garbage-collected objects are dropped once the output table reaches
+        `min_output_table_limit` entries, so until then their IDs may remain.
+        """
+        return list(self._stack[0].output_table)
     
     def push_event(self, event):
         """ Push a new trace event to the builder.
         """
-        if isinstance(event, TraceCall): self._push_call_event(event)
-        elif isinstance(event, TraceReturn): self._push_return_event(event)
-        elif isinstance(event, TraceAccess): self._push_access_event(event)
-        elif isinstance(event, TraceAssign): self._push_assign_event(event)
-        elif isinstance(event, TraceDelete): self._push_delete_event(event)
+        # Dispatch on the exact event type, falling back to the MRO only for
+        # subclasses. Events without a handler are ignored.
+        event_type = event.__class__
+        handler = self._event_handlers.get(event_type)
+        if handler is None:
+            handler = self._get_event_handler(event_type)
+        if handler:
+            handler(event)
     
     def reset(self):
         """ Reset the flow graph builder.
@@ -84,9 +114,11 @@ class FlowGraphBuilder(HasTraits):
         # The bottom of the call stack does not correspond to a call event.
         # It simply contains the root flow graph and associated state.
         graph = new_flow_graph()
-        self._node_names = {}
-        self._stack.clear()
-        self._stack.append(_CallContext(graph=graph))
+        self._annotation_keys.clear()
+        self._node_names.clear()
+        del self._stack[:]
+        self._stack.append(_CallContext(
+            graph=graph, output_table_limit=self.min_output_table_limit))
     
     def is_attribute_ignorable(self, obj):
         """ Can a `getattr` call returning this attribute be removed?
@@ -94,19 +126,21 @@ class FlowGraphBuilder(HasTraits):
         We don't explictly record the retrieval of function, method, and module
         objects (although of course function *calls* are recorded!).
         """
-        # Treat NumPy ufuncs as functions.
-        # XXX: This whole function seems like a hack. Can we do better?
-        np = sys.modules.get('numpy')
-        if np and isinstance(obj, np.ufunc):
-            return True
-
         # Does the object have a "function" type? Note that we don't check if
         # the object is `callable()`, which is too liberal.
-        return isinstance(
-            obj,
-            (type, types.ModuleType, types.FunctionType, types.MethodType,
-             types.BuiltinFunctionType, types.BuiltinMethodType)
-        )
+        if isinstance(obj, _function_types):
+            return True
+        
+        # Treat NumPy ufuncs as functions. NumPy may be imported at any time
+        # during tracing, so the ufunc type is looked up until it is found.
+        # XXX: This whole function seems like a hack. Can we do better?
+        ufunc_type = self._ufunc_type
+        if ufunc_type is None:
+            np = sys.modules.get('numpy')
+            if np is None:
+                return False
+            ufunc_type = self._ufunc_type = np.ufunc
+        return isinstance(obj, ufunc_type)
     
     def is_primitive(self, obj):
         """ Is the object considered primitive?
@@ -120,18 +154,8 @@ class FlowGraphBuilder(HasTraits):
         is JSON-able (essentially, the scalar types plus the built-in container
         types if their contents are JSON-able).
         """
-        # Make sure not to modify the passed object.
-        if isinstance(obj, types.GeneratorType):
-            # Do not pass a generator through `json_clean`, as it will convert
-            # it to list, resulting in an empty generator.
-            return False
-        
-        # Default logic: run IPython's `json_clean`.
-        try:
-            json_clean(obj)
-        except ValueError:
-            return False
-        return True
+        is_primitive, _ = self._get_primitive_value(obj)
+        return is_primitive
     
     def is_pure(self, event, annotation, arg_name):
         """ Is the function call event pure with respect to the given argument?
@@ -157,17 +181,83 @@ class FlowGraphBuilder(HasTraits):
         check the column names and dtypes or even, if the data is small enough,
         a hash of the underlying data.
         """
-        # Special case: important functions knowns to be impure.
-        if (event.qual_name in ('setattr', 'setitem') and
-            arg_name in ('obj', '0')):
-            return False
+        return arg_name not in self._get_impure_arguments(event, annotation)
+    
+    # Protected interface
+    
+    def _get_impure_arguments(self, event, annotation):
+        """ Get the set of names of arguments mutated by a function call.
         
+        See `is_pure` for the conventions on mutation.
+        """
         # Default: pure unless explicitly annotated otherwise!
-        outputs = annotation.get('outputs', [])
-        slots = _IOSlots(event)
-        return not any(arg_name == slots._name(obj['slot']) for obj in outputs)
+        slot_name = _IOSlots(event)._name
+        impure = set(slot_name(obj['slot'])
+                     for obj in annotation.get('outputs', []))
+        
+        # Special case: important functions knowns to be impure.
+        if event.qual_name in ('setattr', 'setitem'):
+            impure.update(('obj', '0'))
+        
+        return impure
     
-    # Protected interface
+    def _get_primitive_value(self, obj):
+        """ Get the JSON-able value of an object if it is primitive.
+        
+        Returns a pair: whether the object is primitive (see `is_primitive`)
+        and, if so, its value. The object is traversed only once.
+        """
+        # Fast path: scalars and empty containers are always primitive, and
+        # some types are known never to be primitive.
+        obj_type = type(obj)
+        if obj_type in _json_safe_types:
+            return True, obj
+        if (obj_type in _scalar_types or
+            (obj_type in _container_types and not obj)):
+            return True, json_clean(obj)
+        if obj_type in self._nonprimitive_types:
+            return False, None
+        
+        # Make sure not to modify the passed object.
+        if isinstance(obj, types.GeneratorType):
+            # Do not pass a generator through `json_clean`, as it will convert
+            # it to list, resulting in an empty generator.
+            return False, None
+        
+        # Containers of JSON-safe scalars need only a shallow copy.
+        if obj_type in _container_types:
+            value = _copy_flat_container(obj)
+            if value is not None:
+                return True, value
+        
+        # Before copying a container with `json_clean`, check that it does not
+        # contain an object of a type already known not to be primitive.
+        if (obj_type in _container_types and self._nonprimitive_types and
+            _contains_type(obj, self._nonprimitive_types)):
+            return False, None
+        
+        # Default logic: run IPython's `json_clean`.
+        try:
+            value = json_clean(obj)
+        except ValueError:
+            # Unless the object is a container or iterator, `json_clean` fails
+            # because of the object's type, so remember it.
+            if not (isinstance(obj, _container_types) or
+                    (hasattr(obj, '__iter__') and hasattr(obj, _next_name))):
+                self._nonprimitive_types[obj_type] = True
+            return False, None
+        return True, value
+    
+    def _get_event_handler(self, event_type):
+        """ Get handler for a subclass of a trace event type.
+        
+        The result is cached, with False meaning that there is no handler.
+        """
+        handlers = self._event_handlers
+        handler = next((handlers[cls] for cls in event_type.__mro__
+                        if cls in handlers), False)
+        handlers[event_type] = handler
+        return handler
             
     def _push_call_event(self, event):
         """ Push a call event onto the stack.
@@ -178,10 +268,11 @@ class FlowGraphBuilder(HasTraits):
         
         # Create a new node for this call.
         annotation = self.annotator.notate_function(event.function) or {}
-        node = self._add_call_node(event, annotation)
+        arg_names = tuple(event.arguments)
+        node = self._add_call_node(event, annotation, arg_names)
         
         # Add edges for function arguments.
-        for arg_name in event.arguments.keys():
+        for arg_name in arg_names:
             self._add_call_in_edge(event, node, arg_name)
         
         # If the call is not atomic, we will enter a new scope.
@@ -192,7 +283,10 @@ class FlowGraphBuilder(HasTraits):
             graph.nodes[node]['graph'] = nested
     
         # Push call context onto stack.
-        self._stack.append(_CallContext(event=event, node=node, graph=nested))
+        self._stack.append(_CallContext(
+            event=event, node=node, graph=nested,
+            annotation=annotation, argument_names=arg_names,
+            output_table_limit=self.min_output_table_limit))
         
     def _push_return_event(self, event):
         """ Push a return event and pop the corresponding call from the stack.
@@ -202,7 +296,8 @@ class FlowGraphBuilder(HasTraits):
         if not context.event.full_name == event.full_name:
             # Sanity check
             raise RuntimeError("Mismatched trace events")
-        node = context.node
+        node, arg_names = context.node, context.argument_names
+        annotation = context.annotation
 
         # Get graph containing this node from context of previous call.
         context = self._stack[-1]
@@ -216,33 +311,44 @@ class FlowGraphBuilder(HasTraits):
             return
         
         # Set output for return value(s).
+        maybe_track = self.object_tracker.maybe_track
+        set_output = self._set_object_output_node
+        all_tracked = True
         if event.multiple_values:
             # Interpret tuples as multiple return values, per Python convention.
             for i, value in enumerate(return_value):
-                value_id = self.object_tracker.maybe_track(value)
+                value_id = maybe_track(value)
                 if value_id:
-                    self._set_object_output_node(
-                        event, value, value_id, node, 'return.%i' % i)
+                    set_output(event, value, value_id, node, 'return.%i' % i)
+                else:
+                    all_tracked = False
         else:
             # All other objects are treated as a single return value.
-            return_id = self.object_tracker.maybe_track(return_value)
+            return_id = maybe_track(return_value)
             if return_id:
-                self._set_object_output_node(
-                    event, return_value, return_id, node, 'return')
+                set_output(event, return_value, return_id, node, 'return')
+            else:
+                all_tracked = False
         
         # Set outputs for mutated arguments.
-        annotation = self.annotator.notate_function(event.function) or {}
-        for arg_name, arg in event.arguments.items():
-            arg_id = self.object_tracker.get_id(arg)
-            if arg_id and not self.is_pure(event, annotation, arg_name):
+        impure = self._get_impure_arguments(event, annotation)
+        mutated_names = [ name for name in arg_names if name in impure ]
+        arguments, get_id = event.arguments, self.object_tracker.get_id
+        for arg_name in mutated_names:
+            arg = arguments[arg_name]
+            arg_id = get_id(arg)
+            if arg_id:
                 port = self._mutated_port_name(arg_name)
-                self._set_object_output_node(event, arg, arg_id, node, port)
+                set_output(event, arg, arg_id, node, port)
         
-        # Update event table with node.
-        context.event_table[event] = (node, 'return')
+        # Update event table with node, unless the return values are tracked
+        # and hence will be found in the output table.
+        if not all_tracked:
+            context.event_table[event] = (node, 'return')
         
         # Update node and port data for this call.
-        self._update_call_node_for_return(event, annotation, node)
+        self._update_call_node_for_return(
+            event, annotation, node, mutated_names)
     
     def _push_access_event(self, event):
         """ Update event table for variable access event.
@@ -261,26 +367,24 @@ class FlowGraphBuilder(HasTraits):
         if isinstance(event.name, six.string_types):
             # Case 1: simple assignment.
             value_id = self.object_tracker.get_id(value)
-            if value_id and value_id in context.output_table:
-                source = context.output_table[value_id]
-            elif value_event and value_event in context.event_table:
-                source = context.event_table[value_event]
-            else:
-                source = None
+            source = context.output_table.get(value_id) if value_id else None
+            if source is None and value_event is not None:
+                source = context.event_table.get(value_event)
             if source is not None:
                 context.variable_table[event.name] = source
 
         else:
             # Case 2: compound assignment.
+            get_id = self.object_tracker.get_id
             for i, name in enumerate(event.name):
-                value_id = self.object_tracker.get_id(value[i])
-                if value_id and value_id in context.output_table:
-                    source = context.output_table[value_id]
-                elif value_event and value_event in context.event_table:
-                    src, src_port = context.event_table[value_event]
-                    source = (src, src_port + '.' + str(i))
-                else:
-                    source = None
+                value_id = get_id(value[i])
+                source = context.output_table.get(value_id) \
+                    if value_id else None
+                if source is None and value_event is not None:
+                    source = context.event_table.get(value_event)
+                    if source is not None:
+                        src, src_port = source
+                        source = (src, src_port + '.' + str(i))
                 if source is not None:
                     context.variable_table[name] = source
 
@@ -291,7 +395,7 @@ class FlowGraphBuilder(HasTraits):
         context = self._stack[-1]
         context.variable_table.pop(event.name, None)
         
-    def _add_call_node(self, event, annotation):
+    def _add_call_node(self, event, annotation, arg_names):
         """ Add a new call node for a call event.
         """
         context = self._stack[-1]
@@ -302,7 +406,7 @@ class FlowGraphBuilder(HasTraits):
             'qual_name': event.qual_name,
             'ports': self._get_ports_data(
                 event,
-                event.arguments.keys(),
+                arg_names,
                 [ dom['slot'] for dom in annotation.get('inputs', []) ],
                 { 'portkind': 'input' },
             ),
@@ -315,8 +419,11 @@ class FlowGraphBuilder(HasTraits):
         graph.add_node(node, **data)
         return node
     
-    def _update_call_node_for_return(self, event, annotation, node):
+    def _update_call_node_for_return(self, event, annotation, node,
+                                     mutated_names):
         """ Update node and port data of call node for a return event.
+        
+        The names of the mutated arguments are given by `mutated_names`.
         """
         context = self._stack[-1]
         graph = context.graph
@@ -339,9 +446,8 @@ class FlowGraphBuilder(HasTraits):
                                 for i in range(len(return_value)) ])
         elif return_value is not None:
             port_names.append('return')
-        for arg_name in event.arguments.keys():
-            if not self.is_pure(event, annotation, arg_name):
-                port_names.append((arg_name, self._mutated_port_name(arg_name)))
+        port_names.extend([ (arg_name, self._mutated_port_name(arg_name))
+                            for arg_name in mutated_names ])
         
         ports = data['ports']
         ports.update(self._get_ports_data(
@@ -398,31 +504,31 @@ class FlowGraphBuilder(HasTraits):
         arg_id = self.object_tracker.maybe_track(arg)
 
         # Get source node and port corresponding to argument, if possible.
-        arg_event = event.argument_events.get(arg_name)
-        if arg_id and arg_id in context.output_table:
-            # First, check if argument object is tracked.
-            src, src_port = context.output_table[arg_id]
-        elif arg_event and arg_event in context.event_table:
+        # First, check if argument object is tracked.
+        source = context.output_table.get(arg_id) if arg_id else None
+        if source is None:
             # If that fails, fall back to static analysis, via the event table.
-            src, src_port = context.event_table[arg_event]
-        else:
-            src, src_port = None, None
+            arg_event = event.argument_events.get(arg_name)
+            if arg_event is not None:
+                source = context.event_table.get(arg_event)
+        src, src_port = source if source is not None else (None, None)
         
         # Add edge if the argument has a known output node.
         if src is not None:
-            self._add_object_edge(arg, src, node, obj_id=arg_id,
-                                  sourceport=src_port, targetport=arg_name)
+            self._add_object_edge(context.graph, arg, src, node,
+                                  obj_id=arg_id, sourceport=src_port,
+                                  targetport=arg_name)
         
         # Otherwise, mark a tracked argument as an unknown input.
         elif arg_id:
             self._add_object_input_node(arg, arg_id, node, arg_name)
     
-    def _add_object_edge(self, obj, source, target, 
+    def _add_object_edge(self, graph, obj, source, target, 
                          obj_id=None, sourceport=None, targetport=None):
-        """ Add an edge corresponding to an object.
+        """ Add an edge corresponding to an object to the given graph.
+        
+        Returns the key of the new edge.
         """
-        context = self._stack[-1]
-        graph = context.graph
         data = {}
         if obj_id is not None:
             data['id'] = obj_id
@@ -433,7 +539,7 @@ class FlowGraphBuilder(HasTraits):
         note = self.annotator.notate_object(obj)
         if note:
             data['annotation'] = self._annotation_key(note)
-        graph.add_edge(source, target, **data)
+        return graph.add_edge(source, target, **data)
     
     def _add_object_input_node(self, obj, obj_id, node, port):
         """ Add an object as an unknown input to a node.
@@ -441,7 +547,7 @@ class FlowGraphBuilder(HasTraits):
         context = self._stack[-1]
         graph = context.graph
         input_node = graph.graph['input_node']
-        self._add_object_edge(obj, input_node, node, obj_id=obj_id,
+        self._add_object_edge(graph, obj, input_node, node, obj_id=obj_id,
                               targetport=port)
     
     def _set_object_output_node(self, event, obj, obj_id, node, port):
@@ -452,33 +558,85 @@ class FlowGraphBuilder(HasTraits):
         """
         context = self._stack[-1]
         graph, output_table = context.graph, context.output_table
+        output_edge_keys = context.output_edge_keys
         output_node = graph.graph['output_node']
+        store_slots = self.store_slots
         
-        # Remove old output, if any.
-        if obj_id in output_table:
-            old, _ = output_table[obj_id]
-            edge_data = graph.get_edge_data(old, output_node)
-            keys = [ key for key, data in edge_data.items()
-                     if data['id'] == obj_id ]
-            assert len(keys) == 1
-            graph.remove_edge(old, output_node, key=keys[0])
+        # Setting an object as output can set its slots as outputs, and so on.
+        # Instead of recursing, keep a stack of the slot generators (see
+        # `_add_object_slots`) paired with the IDs of their objects. This
+        # visits the slots depth-first, in the same order as recursion.
+        todo = [ (None, iter([ (obj, obj_id, node, port) ])) ]
+        while todo:
+            item = next(todo[-1][1], None)
+            if item is None:
+                todo.pop()
+                continue
+            obj, obj_id, node, port = item
+            
+            # Do not follow a reference cycle back to an object whose slots
+            # are being added.
+            if any(obj_id == parent_id for parent_id, _ in todo):
+                continue
+            
+            # Remove old output, if any.
+            if obj_id in output_table:
+                old, _ = output_table[obj_id]
+                graph.remove_edge(old, output_node,
+                                  key=output_edge_keys[obj_id])
+            elif len(output_table) >= context.output_table_limit:
+                self._prune_output_table(context)
+            
+            # Set new output.
+            output_table[obj_id] = (node, port)
+            output_edge_keys[obj_id] = self._add_object_edge(
+                graph, obj, node, output_node, obj_id=obj_id, sourceport=port)
+            
+            # The object has been created or mutated, so fetch its slots.
+            if store_slots:
+                todo.append((obj_id, self._add_object_slots(
+                    graph, event, obj, obj_id, node, port)))
+    
+    def _prune_output_table(self, context):
+        """ Remove garbage-collected objects from the output table.
         
-        # Set new output.
-        output_table[obj_id] = (node, port)
-        self._add_object_edge(obj, node, output_node, obj_id=obj_id,
-                              sourceport=port)
+        The IDs of such objects will never be seen again. To keep the cost of
+        pruning amortized constant, the table is next pruned only once it has
+        doubled in size.
+        """
+        get_object = self.object_tracker.get_object
+        output_table = context.output_table
+        for obj_id in [ obj_id for obj_id in output_table
+                        if get_object(obj_id) is None ]:
+            del output_table[obj_id]
+            del context.output_edge_keys[obj_id]
+        context.output_table_limit = max(
+            self.min_output_table_limit, 2*len(output_table))
+    
+    def _add_object_slots(self, graph, event, obj, obj_id, node, port):
+        """ Add nodes and edges for annotated slots of an object to the given
+        graph.
         
-        # The object has been created or mutated, so fetch its slots.
-        if self.store_slots:
-            self._add_object_slots(event, obj, obj_id, node, port)
-    
-    def _add_object_slots(self, event, obj, obj_id, node, port):
-        """ Add nodes and edges for annotated slots of an object.
+        This is a generator: after adding each slot node, it yields the slot
+        value, if trackable, as a tuple (value, value ID, slot node, port) to be
+        set as output.
         """
-        context = self._stack[-1]
-        graph = context.graph
+        object_tracker = self.object_tracker
         note = self.annotator.notate_object(obj) or {}
-        for slot_index, slot_def in enumerate(note.get('slots', [])):
+        slot_defs = note.get('slots', [])
+        if not slot_defs:
+            return
+        
+        # The annotation and incoming edge are the same for every slot node.
+        # (The input port is not, since getting a slot can change the object.)
+        note_key = self._annotation_key(note)
+        edge_data = {
+            'id': obj_id,
+            'sourceport': port,
+            'targetport': 'self',
+            'annotation': note_key,
+        }
+        for slot_index, slot_def in enumerate(slot_defs):
             slot = slot_def['slot']
             try:
                 slot_value = get_slot(obj, slot)
@@ -487,56 +645,84 @@ class FlowGraphBuilder(HasTraits):
             slot_node = self._node_name('slot:' + str(slot))
             slot_node_data = {
                 'slot': slot,
-                'annotation': self._annotation_key(note),
+                'annotation': note_key,
                 'annotation_index': slot_index+1,
                 'annotation_kind': 'slot',
-                'ports': OrderedDict([
-                    ('self', self._get_port_data(event, obj,
-                        portkind='input',
-                        annotation_index=1,
-                    )),
-                    ('return', self._get_port_data(event, slot_value,
-                        portkind='output',
-                        annotation_index=1,
-                    )),
+                'ports': _ordered_dict([
+                    ('self', self._get_port_data(event, obj, {
+                        'portkind': 'input',
+                        'annotation_index': 1,
+                    })),
+                    ('return', self._get_port_data(event, slot_value, {
+                        'portkind': 'output',
+                        'annotation_index': 1,
+                    })),
                 ])
             }
             graph.add_node(slot_node, **slot_node_data)
-            self._add_object_edge(obj, node, slot_node, obj_id=obj_id,
-                                  sourceport=port, targetport='self')
+            graph.add_edge(node, slot_node, **edge_data)
             
-            # If object is trackable, recursively set it as output.
-            slot_id = self.object_tracker.maybe_track(slot_value)
+            # If object is trackable, it should be set as output.
+            slot_id = object_tracker.maybe_track(slot_value)
             if slot_id:
-                self._set_object_output_node(
-                    event, slot_value, slot_id, slot_node, 'return')
+                yield (slot_value, slot_id, slot_node, 'return')
     
-    def _get_ports_data(self, event, names, annotation=[], extra_data={}):
+    def _get_ports_data(self, event, names, annotation=None, extra_data=None):
         """ Get data for the ports (input or output) of a node.
         """
-        ports = OrderedDict()
-        slots = _IOSlots(event)
-        annotation_table = { 
-            # Index annotations start at 1: it is language-agnostic.
-            slots._name(slot): i+1 for i, slot in enumerate(annotation)
-        }
+        annotation = annotation or []
+        extra_data = extra_data or {}
+        ports = _ordered_dict()
+        arguments = event.arguments
+        
+        # Map slot names to annotation indices, resolving integer slots to
+        # argument names as in `_IOSlots._name`.
+        # Index annotations start at 1: it is language-agnostic.
+        annotation_table = {}
+        arg_names = None
+        for i, slot in enumerate(annotation):
+            if isinstance(slot, int):
+                if arg_names is None:
+                    arg_names = tuple(arguments)
+                try:
+                    slot = arg_names[slot]
+                except IndexError:
+                    slot = None
+            annotation_table[slot] = i+1
+        
+        slots = None
         for name in names:
             name, portname = name if isinstance(name, tuple) else (name, name)
-            try:
-                obj = get_slot(slots, name)
-            except AttributeError:
-                obj = None
             
-            data = self._get_port_data(event, obj, argname=name, **extra_data)
-            if name in annotation_table:
-                data['annotation_index'] = annotation_table[name]
-            ports[portname] = data
+            # Look up arguments and return values directly, falling back to
+            # the general slot machinery for compound slots like 'return.0'.
+            if name in arguments:
+                obj = arguments[name]
+            elif name == 'return':
+                obj = event.value
+            else:
+                if slots is None:
+                    slots = _IOSlots(event)
+                try:
+                    obj = get_slot(slots, name)
+                except AttributeError:
+                    obj = None
+            
+            port_data = { 'argname': name }
+            port_data.update(extra_data)
+            index = annotation_table.get(name)
+            if index is not None:
+                port_data['annotation_index'] = index
+            ports[portname] = self._get_port_data(event, obj, port_data)
         return ports
     
-    def _get_port_data(self, event, obj, **extra_data):
+    def _get_port_data(self, event, obj, extra_data=None):
         """ Get data for a single port on a node.
+        
+        The data starts from a copy of `extra_data`, if given, so the caller's
+        dictionary is never modified.
         """
-        data = extra_data
+        data = dict(extra_data) if extra_data else {}
         if obj is None:
             return data
         
@@ -546,8 +732,9 @@ class FlowGraphBuilder(HasTraits):
             data['id'] = obj_id
         
         # Add value if the object is primitive.
-        if self.is_primitive(obj):
-            data['value'] = json_clean(obj)
+        is_primitive, value = self._get_primitive_value(obj)
+        if is_primitive:
+            data['value'] = value
         elif isinstance(obj, types.ModuleType):
             data['value'] = obj.__name__
 
@@ -568,17 +755,21 @@ class FlowGraphBuilder(HasTraits):
     def _annotation_key(self, note):
         """ Get a key identifying an annotation.
         """
-        keys = ('language', 'package', 'id')
-        return '/'.join(note[key] for key in keys)
+        # Cache the key by object identity, since the annotator returns the
+        # same annotation objects each time. The cache holds a reference to
+        # the annotation so that its ID is not reused.
+        entry = self._annotation_keys.get(id(note))
+        if entry is None:
+            key = '/'.join(note[k] for k in ('language', 'package', 'id'))
+            entry = self._annotation_keys[id(note)] = (note, key)
+        return entry[1]
     
     def _node_name(self, base):
         """ Get node name unique within flow graph, including nested graphs.
 
         The node names are deterministic across runs.
         """
-        count = self._node_names.get(base, 0) + 1
-        self._node_names[base] = count
-        return base + ":" + str(count)
+        return '%s:%i' % (base, next(self._node_names[base]))
     
     def _mutated_port_name(self, arg_name):
         """ Get name of output port for a mutated argument.
@@ -591,43 +782,126 @@ class FlowGraphBuilder(HasTraits):
         return arg_name + '!'
 
 
-class _CallContext(HasTraits):
+# Dictionary type for node ports, whose order is significant. Built-in dicts
+# preserve insertion order as of Python 3.7 and are faster to construct.
+_ordered_dict = dict if sys.version_info >= (3, 7) else OrderedDict
+
+def _copy_flat_container(obj):
+    """ Copy a built-in container of JSON-safe scalars, as `json_clean` would.
+    
+    Returns None if the container holds any other kind of object.
+    """
+    if type(obj) is dict:
+        if all(type(key) is six.text_type and type(value) in _json_safe_types
+               for key, value in obj.items()):
+            return dict(obj)
+    elif all(type(value) in _json_safe_types for value in obj):
+        return list(obj)
+    return None
+
+
+def _contains_type(obj, type_set):
+    """ Does a built-in container contain, at any depth, an instance of one of
+    the given types?
+    
+    Only instances of the exact built-in container types are searched.
+    """
+    for value in (obj.values() if type(obj) is dict else obj):
+        value_type = type(value)
+        if value_type in type_set:
+            return True
+        if value_type in _container_types and _contains_type(value, type_set):
+            return True
+    return False
+
+
+# Types whose instances are considered functions (see `is_attribute_ignorable`).
+_function_types = (
+    type, types.ModuleType, types.FunctionType, types.MethodType,
+    types.BuiltinFunctionType, types.BuiltinMethodType
+)
+
+# Types whose instances are always primitive (see `is_primitive`).
+_scalar_types = frozenset(
+    (bool, float, type(None), six.text_type, six.binary_type) +
+    six.integer_types
+)
+
+# Types whose instances are returned unchanged by `json_clean`.
+# (Unlike the other scalars, floats are not: NaN and infinity are converted.)
+_json_safe_types = frozenset(
+    (bool, type(None), six.text_type) + six.integer_types
+)
+
+# Built-in container types accepted by `json_clean`.
+_container_types = (dict, list, set, tuple)
+
+# Name of iterator method, which `json_clean` uses to detect iterators.
+_next_name = '__next__' if six.PY3 else 'next'
+
+
+class _CallContext(object):
     """ Context for a trace call event.
     
-    Internal state for FlowGraphBuilder.
+    Internal state for FlowGraphBuilder. This is a plain class, rather than a
+    `HasTraits`, because its attributes are accessed on every trace event.
     """
-    # The trace call event for this call stack item.
-    event = Instance(TraceCall)
-    
-    # Name of graph node created for call, if any.
-    node = Unicode()
-    
-    # Flow graph nested in node, if any.
-    graph = Instance(nx.MultiDiGraph, allow_none=True)
-    
-    # Output table: mapping from object ID to (node, output port) pair.
-    #
-    # At any given time during execution, an object is the output of at most
-    # one node, i.e., there is at most one incoming edge to the special output
-    # node that carries a particular object. We maintain this mapping as an
-    # auxiliary data structure called the "output table". It is logically
-    # superfluous--the same information is captured by the graph topology--but
-    # it improves efficiency by allowing constant-time lookup.
-    output_table = Dict()
-
-    # Variable table: mapping from variable names to (node, output port) pair.
-    #
-    # A complement to object tracking, which doesn't work for objects that
-    # are not weak referenceable.
-    variable_table = Dict()
-
-    # Event table: mapping from trace event to (node, output port) pair.
-    #
-    # Like the variable table, the event table is only relevant for objects
-    # that can't be tracked. The dictionary has weak reference keys because we
-    # want to allow the trace events to be garbage collected once they've
-    # passed through the system.
-    event_table = Instance(WeakKeyDictionary, ())
+    
+    __slots__ = ('event', 'node', 'graph', 'annotation', 'argument_names',
+                 'output_table', 'output_edge_keys', 'output_table_limit',
+                 'variable_table', 'event_table')
+    
+    def __init__(self, event=None, node='', graph=None, annotation=None,
+                 argument_names=(), output_table_limit=1024):
+        # The trace call event for this call stack item.
+        self.event = event
+        
+        # Name of graph node created for call, if any.
+        self.node = node
+        
+        # Flow graph nested in node, if any.
+        self.graph = graph
+        
+        # Annotation of the called function, reused for the return event.
+        self.annotation = annotation
+        
+        # Names of the arguments of the call, in order.
+        self.argument_names = argument_names
+        
+        # Output table: mapping from object ID to (node, output port) pair.
+        #
+        # At any given time during execution, an object is the output of at
+        # most one node, i.e., there is at most one incoming edge to the special
+        # output node that carries a particular object. We maintain this
+        # mapping as an auxiliary data structure called the "output table". It
+        # is logically superfluous--the same information is captured by the
+        # graph topology--but it improves efficiency by allowing constant-time
+        # lookup.
+        self.output_table = {}
+        
+        # Output edge keys: mapping from object ID to key of edge to output
+        # node.
+        #
+        # Auxiliary to the output table, for constant-time removal of outputs.
+        self.output_edge_keys = {}
+        
+        # Size of output table at which to prune garbage-collected objects.
+        self.output_table_limit = output_table_limit
+        
+        # Variable table: mapping from variable names to (node, output port)
+        # pair.
+        #
+        # A complement to object tracking, which doesn't work for objects that
+        # are not weak referenceable.
+        self.variable_table = {}
+        
+        # Event table: mapping from trace event to (node, output port) pair.
+        #
+        # Like the variable table, the event table is only relevant for objects
+        # that can't be tracked. The dictionary has weak reference keys because
+        # we want to allow the trace events to be garbage collected once
+        # they've passed through the system.
+        self.event_table = WeakKeyDictionary()
 
 
 class _IOSlots(object):
@@ -635,18 +909,27 @@ class _IOSlots(object):
     
     Implementation detail of FlowGraphBuilder.
     """
+    
+    __slots__ = ('__event', '__argument_names')
 
     def __init__(self, event):
         self.__event = event
+        self.__argument_names = None
+    
+    @property
+    def _argument_names(self):
+        """ Tuple of argument names, computed on first use.
+        """
+        if self.__argument_names is None:
+            self.__argument_names = tuple(self.__event.arguments)
+        return self.__argument_names
     
     def _name(self, slot):
         """ Map the function slot (integer or string) to a string name, if any.
         """
-        event = self.__event
         if isinstance(slot, int):
-            argument_names = list(event.arguments.keys())
             try:
-                return argument_names[slot]
+                return self._argument_names[slot]
             except IndexError:
                 return None
         return slot
@@ -662,5 +945,4 @@ class _IOSlots(object):
     
     def __getitem__(self, index):
         event = self.__event
-        argument_names = list(event.arguments.keys())
-        return event.arguments[argument_names[index]]
+        return event.arguments[self._argument_names[index]]
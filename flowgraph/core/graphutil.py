@@ -31,3 +31,13 @@ def find_nodes(graph, query, data=False):
     """
     return ((v, graph.nodes[v]) if data else v 
             for v in graph if query(graph.nodes[v]))
+
+def graph_data(graph):
+    """ Get all the data of a networkx graph, as plain dictionaries.
+    """
+    if graph.is_multigraph():
+        edges = graph.edges(keys=True, data=True)
+    else:
+        edges = graph.edges(data=True)
+    return (graph.graph, dict(graph.nodes(data=True)),
+            { edge[:-1]: edge[-1] for edge in edges })
@@ -19,6 +19,7 @@ the `FlowGraphBuilder` and `Tracer` into easy-to-use functions.
 """
 from __future__ import absolute_import
 
+import ast
 import os
 
 from traitlets import HasTraits, Instance
@@ -62,26 +63,21 @@ def record_code(code, codename=None, out=None, env=None, cwd=None, db=None,
         Extra arguments to pass to `FlowGraphBuilder`
     """
     # Set up flow graph builder.
-    db = db or RemoteAnnotationDB.from_library_config()
+    db = db or _get_default_db()
     builder = FlowGraphBuilder(**kwargs)
     builder.annotator.db = db
 
     # Set up tracer.
-    def handle_trace_event(changed):
-        event = changed['new']
-        if event:
-            builder.push_event(event)
     tracer = Tracer()
+    tracer.add_event_handler(builder.push_event)
 
     # Evaluate the code in the right working directory and environment.
     if cwd is not None:
         oldcwd = os.getcwd()
         os.chdir(cwd)
-    tracer.observe(handle_trace_event, 'event')
     try:
         tracer.trace(code, codename=codename, env=env)
     finally:
-        tracer.unobserve(handle_trace_event, 'event')
         if cwd is not None:
             os.chdir(oldcwd)
     graph = builder.graph
@@ -105,8 +101,33 @@ def record_script(filename, **kwargs):
     **kwargs
         Extra arguments to pass to `record_code`
     """
-    # Read the script.
-    with open(filename) as f:
-        code = f.read()
+    # Read and parse the script. The source is read as bytes so that the
+    # parser, rather than the locale, determines the encoding (PEP 263).
+    with open(filename, 'rb') as f:
+        node = ast.parse(f.read(), filename)
     
-    return record_code(code, codename=filename, **kwargs)
+    return record_code(node, codename=filename, **kwargs)
+
+
+def invalidate_default_db():
+    """ Discard the standard remote annotation DB shared across recordings.
+    
+    The next recording creates a fresh database, which fetches the package
+    annotations from the remote server again.
+    """
+    global _default_db
+    _default_db = None
+
+
+def _get_default_db():
+    """ Get the standard remote annotation DB, shared across recordings.
+    
+    Sharing the database avoids fetching the same package annotations from the
+    remote server for every recording.
+    """
+    global _default_db
+    if _default_db is None:
+        _default_db = RemoteAnnotationDB.from_library_config()
+    return _default_db
+
+_default_db = None
@@ -16,7 +16,6 @@ from __future__ import absolute_import
 
 from pathlib2 import Path
 
-import requests
 from traitlets import Bool, Dict, Instance, Unicode, default
 from traitlets.config import Configurable, PyFileConfigLoader
 
@@ -90,6 +89,9 @@ class RemoteAnnotationDB(AnnotationDB, Configurable):
 
         Returns the JSON response data.
         """
+        # Import on first request, since `requests` is slow to import and
+        # many users of the database never make a request.
+        import requests
         response = requests.get(self.api_url + endpoint)
         return response.json()
     
@@ -52,6 +52,25 @@ class TestAnnotationDB(unittest.TestCase):
         self.assertEqual(len(notes), 1)
         self.assertEqual(notes[0]['id'], 'foo')
     
+    def test_filter_many(self):
+        """ Test a multi-document query spanning several packages.
+        """
+        query = {'kind': 'type', 'id': 'int'}
+        notes = list(self.db.filter_many(query, ['flowgraph', 'builtins']))
+        self.assertEqual(len(notes), 1)
+        self.assertEqual(notes[0]['id'], 'int')
+
+        query = {'kind': 'type'}
+        notes = list(self.db.filter_many(query, ['builtins']))
+        self.assertEqual(len(notes), 3)
+
+    def test_has_package(self):
+        """ Test that the database knows which packages it has loaded.
+        """
+        self.assertTrue(self.db.has_package('flowgraph'))
+        self.assertTrue(self.db.has_package('builtins'))
+        self.assertFalse(self.db.has_package('XXX'))
+
     def test_or_operator(self):
         """ Tes that the `$or` query operator works.
         """
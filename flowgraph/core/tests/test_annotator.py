@@ -14,20 +14,27 @@
 
 from __future__ import absolute_import
 
+import json
 from pathlib2 import Path
 import unittest
 
 from . import objects
+from ..annotation_db import AnnotationDB
 from ..annotator import Annotator
 
 
 class TestAnnotator(unittest.TestCase):
     
-    def setUp(self):
+    @classmethod
+    def setUpClass(cls):
         objects_path = Path(objects.__file__).parent
         json_path = objects_path.joinpath('data', 'annotations.json')
-        self.annotator = Annotator()
-        self.annotator.db.load_file(json_path)
+        cls.json_path = json_path
+        cls.db = AnnotationDB()
+        cls.db.load_file(json_path)
+    
+    def setUp(self):
+        self.annotator = Annotator(db=self.db)
     
     def test_function(self):
         """ Can we notate a function?
@@ -37,6 +44,16 @@ class TestAnnotator(unittest.TestCase):
         self.assertEqual(note['language'], 'python')
         self.assertEqual(note['package'], 'flowgraph')
     
+    def test_function_cache(self):
+        """ Are function annotations cached?
+        """
+        note = self.annotator.notate_function(objects.create_foo)
+        self.assertIs(self.annotator.notate_function(objects.create_foo), note)
+        
+        note = self.annotator.notate_function(objects.Foo().do_sum)
+        self.assertIs(self.annotator.notate_function(objects.Foo().do_sum),
+                      note)
+    
     def test_method_basic(self):
         """ Can we notate a method?
         """
@@ -90,6 +107,106 @@ class TestAnnotator(unittest.TestCase):
         note = self.annotator.notate_type(objects.Baz)
         self.assertEqual(note['id'], 'baz')
 
+    
+    def test_prefetch(self):
+        """ Do we get the same annotations from prefetched packages?
+        """
+        self.annotator.prefetch(['flowgraph', 'builtins'])
+        
+        note = self.annotator.notate_function(objects.create_foo)
+        self.assertEqual(note['id'], 'create-foo')
+        note = self.annotator.notate_function(objects.Bar().do_prod)
+        self.assertEqual(note['id'], 'bar-prod')
+        note = self.annotator.notate_type(objects.BarWithMixin)
+        self.assertEqual(note['id'], 'bar-with-mixin')
+        note = self.annotator.notate_object(0)
+        self.assertEqual(note['id'], 'int')
+
+    def test_prefetch_user_package(self):
+        """ Are lookups answered without querying the database after
+        prefetching only a user package?
+        """
+        db = QueryCountingAnnotationDB()
+        db.load_file(self.json_path)
+        annotator = Annotator(db=db)
+        annotator.prefetch(['flowgraph'])
+        queries = db.queries
+        
+        note = annotator.notate_type(objects.Foo)
+        self.assertEqual(note['id'], 'foo')
+        note = annotator.notate_function(objects.Foo().do_sum)
+        self.assertEqual(note['id'], 'foo-sum')
+        note = annotator.notate_object(0)
+        self.assertEqual(note['id'], 'int')
+        self.assertEqual(db.queries, queries)
+    
+    def test_unannotated_package(self):
+        """ Are lookups in packages without annotations answered without
+        querying the database?
+        """
+        db = QueryCountingAnnotationDB()
+        db.load_file(self.json_path)
+        annotator = Annotator(db=db)
+        
+        note = annotator.notate_function(objects.create_foo)
+        self.assertEqual(note['id'], 'create-foo')
+        queries = db.queries
+        
+        UserType = type('UserType', (object,), {'__module__': 'userpkg'})
+        annotator.notate_type(UserType)
+        self.assertEqual(db.queries, queries + 1) # Only builtins
+        
+        def user_func():
+            pass
+        user_func.__module__ = 'userpkg'
+        self.assertEqual(annotator.notate_function(user_func), None)
+        self.assertEqual(db.queries, queries + 1)
+    
+    def test_late_loaded_package(self):
+        """ Are annotations loaded after a failed lookup in their package found?
+        """
+        with self.json_path.open('r') as f:
+            notes = json.load(f)
+        db = AnnotationDB()
+        db.load_documents(note for note in notes
+                          if note['package'] != 'flowgraph')
+        annotator = Annotator(db=db)
+        self.assertEqual(annotator.notate_function(objects.create_foo), None)
+        
+        db.load_documents(note for note in notes
+                          if note['package'] == 'flowgraph')
+        note = annotator.notate_type(objects.Foo)
+        self.assertEqual(note['id'], 'foo')
+    
+    def test_prefetch_late_loaded_package(self):
+        """ Are annotations loaded after prefetching their package found?
+        """
+        with self.json_path.open('r') as f:
+            notes = json.load(f)
+        db = AnnotationDB()
+        db.load_documents(note for note in notes
+                          if note['package'] != 'flowgraph')
+        annotator = Annotator(db=db)
+        annotator.prefetch(['flowgraph'])
+        
+        db.load_documents(note for note in notes
+                          if note['package'] == 'flowgraph')
+        note = annotator.notate_function(objects.create_foo)
+        self.assertEqual(note['id'], 'create-foo')
+
+
+class QueryCountingAnnotationDB(AnnotationDB):
+    """ Annotation DB that counts the queries made to it.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super(QueryCountingAnnotationDB, self).__init__(*args, **kwargs)
+        self.queries = 0
+    
+    def filter(self, query):
+        self.queries += 1
+        return super(QueryCountingAnnotationDB, self).filter(query)
+
 
 if __name__ == '__main__':
     unittest.main()
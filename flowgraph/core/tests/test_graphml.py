@@ -18,6 +18,7 @@ import unittest
 import networkx as nx
 
 from ..graphml import read_graphml_str, write_graphml_str
+from ..graphutil import graph_data
 
 
 def roundtrip(graph, **kwargs):
@@ -41,9 +42,7 @@ class TestGraphMLIO(unittest.TestCase):
             graph.graph.pop('node_default', None)
             graph.graph.pop('edge_default', None)
         
-        self.assertEqual(one.graph, two.graph)
-        self.assertEqual(one.nodes, two.nodes)
-        self.assertEqual(one.edges, two.edges)
+        self.assertEqual(graph_data(one), graph_data(two))
 
     def test_basic_graph(self):
         """ Can we round-trip a basic directed graph?
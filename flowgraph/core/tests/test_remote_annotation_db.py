@@ -16,6 +16,7 @@ from __future__ import absolute_import
 
 import unittest
 
+from ..record import _get_default_db, invalidate_default_db
 from ..remote_annotation_db import RemoteAnnotationDB
 
 
@@ -49,3 +50,13 @@ class TestRemoteAnnotationDB(unittest.TestCase):
         """ Test that no requests are made for unannotated packages.
         """
         self.assertFalse(self.db.load_package("XXX"))
+    
+    def test_invalidate_default_db(self):
+        """ Test that the default annotation DB is shared until invalidated.
+        """
+        db = _get_default_db()
+        self.assertIsInstance(db, RemoteAnnotationDB)
+        self.assertIs(_get_default_db(), db)
+        
+        invalidate_default_db()
+        self.assertIsNot(_get_default_db(), db)
@@ -138,10 +138,5 @@ class FlowGraphIPythonKernel(IPythonKernel):
             store_slots=self.flow_graph_slots,
         )
 
-        def handler(changed):
-            event = changed['new']
-            if event:
-                builder.push_event(event)
-        self._tracer.observe(handler, 'event')
-    
+        self._tracer.add_event_handler(builder.push_event)
         return builder
@@ -100,6 +100,20 @@ def to_tuple(elts, ctx=None):
 
 # Miscellaneous
 
+def get_imported_packages(node):
+    """ Get names of top-level packages imported anywhere in the AST.
+    
+    Relative imports are ignored.
+    """
+    packages = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Import):
+            packages.update(alias.name.split('.')[0] for alias in child.names)
+        elif isinstance(child, ast.ImportFrom):
+            if child.module and not child.level:
+                packages.add(child.module.split('.')[0])
+    return packages
+
 def get_single_target(node):
     """ Check that AST node has single target and return it.
     """
@@ -0,0 +1,45 @@
+# Copyright 2018 IBM Corp.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+
+import ast
+from textwrap import dedent
+import unittest
+
+from ..ast_util import get_imported_packages
+
+
+class TestASTUtil(unittest.TestCase):
+    """ Test cases for abstract syntax tree (AST) utilities.
+    """
+    
+    def test_imported_packages(self):
+        """ Can we get the top-level packages imported in a module?
+        """
+        node = ast.parse(dedent("""
+            import os.path
+            import numpy as np, scipy.stats
+            from pandas.io import json
+            from . import sibling
+            
+            def f():
+                from sklearn import linear_model
+        """))
+        self.assertEqual(get_imported_packages(node),
+                         set(['os', 'numpy', 'scipy', 'pandas', 'sklearn']))
+
+
+if __name__ == '__main__':
+    unittest.main()
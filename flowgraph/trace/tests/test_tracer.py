@@ -97,6 +97,24 @@ class TestTracer(unittest.TestCase):
         self.assertEqual(event.module_name, objects.__name__)
         self.assertEqual(event.qual_name, 'bar_from_foo')
     
+    def test_event_handler(self):
+        """ Do event handlers receive the same events as trait observers?
+        """
+        events = []
+        self.tracer.add_event_handler(events.append)
+        self.trace("""
+            foo = objects.Foo()
+            bar = objects.bar_from_foo(foo, x=1, y=2)
+        """)
+        self.tracer.remove_event_handler(events.append)
+        
+        self.assertEqual(
+            [ e for e in events if self.filter_trace_function_event(e) ],
+            self.function_events)
+        self.assertEqual(
+            [ e for e in events if self.filter_trace_variable_event(e) ],
+            self.variable_events)
+    
     def test_basic_return(self):
         """ Are function returns traced?
         """
@@ -52,7 +52,24 @@ class Tracer(ASTTracer):
     # Scope stack for currently executing code.
     _stack = Instance(deque, ()) # List(Instance(_ScopeItem))
     
+    # Handlers called directly with each trace event.
+    _event_handlers = Instance(list, ())
+    
     # Tracer interface
+    
+    def add_event_handler(self, handler):
+        """ Add a handler to be called with each trace event.
+        
+        Handlers are called before observers of the `event` trait are notified.
+        Calling a handler directly is cheaper than observing the trait, so this
+        is the preferred way to consume events when tracing large programs.
+        """
+        self._event_handlers.append(handler)
+    
+    def remove_event_handler(self, handler):
+        """ Remove a handler added by `add_event_handler`.
+        """
+        self._event_handlers.remove(handler)
 
     def trace(self, code_or_node, codename=None, env=None):
         """ Execute and trace Python code.
@@ -153,7 +170,7 @@ class Tracer(ASTTracer):
         emit_events = prev_scope.emit_events and \
             not (prev_scope.event and prev_scope.event.atomic)
         if emit_events:
-            self.event = event
+            self._emit_event(event)
 
         scope = _ScopeItem(event=event, emit_events=emit_events)
         self._stack.append(scope)
@@ -181,7 +198,7 @@ class Tracer(ASTTracer):
         event = self._create_return_event(
             scope.event, return_value, multiple_values)
         if scope.emit_events:
-            self.event = event
+            self._emit_event(event)
 
         return event
     
@@ -192,7 +209,8 @@ class Tracer(ASTTracer):
 
         # Create access event.
         if scope.emit_events:
-            self.event = event = TraceAccess(name=name, value=value)
+            event = TraceAccess(name=name, value=value)
+            self._emit_event(event)
             return event
         
         return value
@@ -210,8 +228,9 @@ class Tracer(ASTTracer):
 
         # Create assign event.
         if scope.emit_events:
-            self.event = event = TraceAssign(
+            event = TraceAssign(
                 name=name, value=value, value_event=value_event)
+            self._emit_event(event)
             return event
         
         return value
@@ -221,9 +240,16 @@ class Tracer(ASTTracer):
         """
         scope = self._stack[-1]
         if scope.emit_events:
-            self.event = TraceDelete(name=name)
+            self._emit_event(TraceDelete(name=name))
     
     # Protected interface
+    
+    def _emit_event(self, event):
+        """ Emit a trace event to the handlers and the `event` trait.
+        """
+        for handler in self._event_handlers:
+            handler(event)
+        self.event = event
 
     def _prepare_env(self):
         """ Prepare the environment in which code will be excecuted.
@@ -20,7 +20,6 @@ setup_args = {
         'jsonpickle',
         'click',
         'networkx>=2.0',
-        'cachetools==2.1.0',
         'blitzdb @ git+https://github.com/adewes/blitzdb.git',
         'sqlalchemy',
         'ipykernel>=4.3.0',